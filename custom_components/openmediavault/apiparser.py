@@ -2,8 +2,7 @@
 
 
 import logging
-import pytz
-from datetime import datetime
+from datetime import datetime, timezone
 
 from voluptuous import Optional
 from homeassistant.components.diagnostics import async_redact_data
@@ -14,7 +13,7 @@ _LOGGER = logging.getLogger(__name__)
 
 def utc_from_timestamp(timestamp: float) -> datetime:
     """Return a UTC time from a timestamp."""
-    return pytz.utc.localize(datetime.utcfromtimestamp(timestamp))
+    return datetime.fromtimestamp(timestamp, timezone.utc)
 
 
 # ---------------------------
@@ -2,6 +2,7 @@
 
 import json
 import logging
+from hashlib import blake2b
 from os import path
 from pickle import dump as pickle_dump
 from pickle import load as pickle_load
@@ -9,10 +10,33 @@ from threading import Lock
 from time import time
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from voluptuous import Optional
 
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
 _LOGGER = logging.getLogger(__name__)
 
+# Seconds a query response is reused before it is fetched again
+QUERY_TTL = {
+    ("DiskMgmt", "enumerateDevices"): 3540,
+    ("Plugin", "enumeratePlugins"): 3540,
+    ("Smart", "getInformation"): 3540,
+    ("System", "getInformation"): 55,
+}
+
+
+# ---------------------------
+#   query_cache_key
+# ---------------------------
+def query_cache_key(service, method, params=None) -> tuple:
+    """Return query cache key."""
+    return service, method, json.dumps(params or {}, sort_keys=True)
+
 
 # ---------------------------
 #   load_cookies
@@ -34,6 +58,28 @@ def save_cookies(filename: str, data: dict):
         pickle_dump(data, f)
 
 
+# ---------------------------
+#   create_session
+# ---------------------------
+def create_session() -> requests.Session:
+    """Create HTTP session with connection pooling and retries."""
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=10,
+        max_retries=Retry(
+            total=2,
+            backoff_factor=0.2,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset({"POST"}),
+            raise_on_status=False,
+        ),
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
 # ---------------------------
 #   OpenMediaVaultAPI
 # ---------------------------
@@ -57,11 +103,19 @@ class OpenMediaVaultAPI(object):
 
         self._connection = None
         self._cookie_jar = None
-        self._cookie_jar_file = self._hass.config.path(".omv_cookies.json")
+        # Host may contain a path, key the file by a hash of user and host
+        cookie_key = blake2b(
+            f"{self._username}@{self._host}".encode(), digest_size=8
+        ).hexdigest()
+        self._cookie_jar_file = self._hass.config.path(
+            ".storage", f"openmediavault_{cookie_key}.cookies"
+        )
+        self._restore_session = True
         self._connected = False
         self._reconnected = False
         self._connection_epoch = 0
         self._connection_retry_sec = 58
+        self._cache = {}
         self.error = None
         self.connection_error_reported = False
         self.accounting_last_run = None
@@ -86,11 +140,33 @@ class OpenMediaVaultAPI(object):
             if self._connection_epoch > time() - self._connection_retry_sec:
                 return False
 
-            if not self.connect():
+            if not self.restore_session() and not self.connect():
                 return False
 
         return True
 
+    # ---------------------------
+    #   restore_session
+    # ---------------------------
+    def restore_session(self) -> bool:
+        """Reuse session cookies saved by a previous login."""
+        if not self._restore_session:
+            return False
+
+        self._restore_session = False
+        with self.lock:
+            if not (cookies := load_cookies(self._cookie_jar_file)):
+                return False
+
+            self._connection_epoch = time()
+            self._connection = create_session()
+            self._connection.cookies.update(cookies)
+            self._connected = True
+            self._reconnected = True
+
+        _LOGGER.debug("OpenMediaVault %s session restored", self._host)
+        return True
+
     # ---------------------------
     #   disconnect
     # ---------------------------
@@ -113,107 +189,120 @@ class OpenMediaVaultAPI(object):
         self._connected = False
         self._connection = None
         self._connection_epoch = 0
+        self._cache = {}
 
     # ---------------------------
     #   connect
     # ---------------------------
-    def connect(self) -> bool:
+    def connect(self, expired_connection=None) -> bool:
         """Connect API."""
-        self.error = None
-        self._connected = False
-        self._connection_epoch = time()
-        self._connection = requests.Session()
-        self._cookie_jar = requests.cookies.RequestsCookieJar()
+        with self.lock:
+            # Another thread already replaced the expired session
+            if (
+                expired_connection is not None
+                and self._connection is not expired_connection
+                and self._connected
+            ):
+                return True
 
-        # Load cookies
-        if cookies := load_cookies(self._cookie_jar_file):
-            self._connection.cookies.update(cookies)
+            self.error = None
+            self._connection_epoch = time()
+            connection = create_session()
+            self._cookie_jar = requests.cookies.RequestsCookieJar()
 
-        self.lock.acquire()
-        error = False
-        try:
-            response = self._connection.post(
-                self._resource,
-                data=json.dumps(
-                    {
-                        "service": "session",
-                        "method": "login",
-                        "params": {
-                            "username": self._username,
-                            "password": self._password,
-                        },
-                    }
-                ),
-                verify=self._ssl_verify,
-            )
+            # Load cookies
+            if cookies := load_cookies(self._cookie_jar_file):
+                connection.cookies.update(cookies)
 
-            if response.status_code != 200:
-                error = True
+            error = False
+            try:
+                response = connection.post(
+                    self._resource,
+                    data=json.dumps(
+                        {
+                            "service": "session",
+                            "method": "login",
+                            "params": {
+                                "username": self._username,
+                                "password": self._password,
+                            },
+                        }
+                    ),
+                    verify=self._ssl_verify,
+                )
 
-            data = response.json()
-            if data["error"] is not None:
-                if not self.connection_error_reported:
-                    _LOGGER.error(
-                        "OpenMediaVault %s unable to connect: %s",
+                if response.status_code != 200:
+                    error = True
+
+                data = json_loads(response.content)
+                if data["error"] is not None:
+                    if not self.connection_error_reported:
+                        _LOGGER.error(
+                            "OpenMediaVault %s unable to connect: %s",
+                            self._host,
+                            data["error"]["message"],
+                        )
+                        self.connection_error_reported = True
+
+                    self.error_to_strings("%s" % data["error"]["message"])
+                    self._connected = False
+                    self._connection = None
+                    return False
+
+                if not data["response"]["authenticated"]:
+                    _LOGGER.error("OpenMediaVault %s authenticated failed", self._host)
+                    self.error_to_strings()
+                    self._connected = False
+                    self._connection = None
+                    return False
+
+            except requests.exceptions.ConnectionError as api_error:
+                error = True
+                self.error_to_strings("%s" % api_error)
+            except:
+                error = True
+            else:
+                if self.connection_error_reported:
+                    _LOGGER.warning("OpenMediaVault %s reconnected", self._host)
+                    self.connection_error_reported = False
+                else:
+                    _LOGGER.debug("OpenMediaVault %s connected", self._host)
+
+                self._connection = connection
+                self._connected = True
+                self._reconnected = True
+                for cookie in connection.cookies:
+                    self._cookie_jar.set_cookie(cookie)
+
+                try:
+                    save_cookies(self._cookie_jar_file, self._cookie_jar)
+                except OSError as save_error:
+                    _LOGGER.warning(
+                        "OpenMediaVault %s unable to save cookies: %s",
                         self._host,
-                        data["error"]["message"],
+                        save_error,
                     )
-                    self.connection_error_reported = True
-
-                self.error_to_strings("%s" % data["error"]["message"])
-                self._connection = None
-                self.lock.release()
-                return False
-
-            if not data["response"]["authenticated"]:
-                _LOGGER.error("OpenMediaVault %s authenticated failed", self._host)
-                self.error_to_strings()
-                self._connection = None
-                self.lock.release()
-                return False
-
-        except requests.exceptions.ConnectionError as api_error:
-            error = True
-            self.error_to_strings("%s" % api_error)
-            self._connection = None
-        except:
-            error = True
-        else:
-            if self.connection_error_reported:
-                _LOGGER.warning("OpenMediaVault %s reconnected", self._host)
-                self.connection_error_reported = False
-            else:
-                _LOGGER.debug("OpenMediaVault %s connected", self._host)
-
-            self._connected = True
-            self._reconnected = True
-            self.lock.release()
-            for cookie in self._connection.cookies:
-                self._cookie_jar.set_cookie(cookie)
-
-            save_cookies(self._cookie_jar_file, self._cookie_jar)
 
-        # Socket errors
-        if error:
-            try:
-                errorcode = response.status_code
-            except:
-                errorcode = "no_respose"
+            # Socket errors
+            if error:
+                try:
+                    errorcode = response.status_code
+                except:
+                    errorcode = "no_respose"
 
-            if errorcode == 200:
-                errorcode = "cannot_connect"
+                if errorcode == 200:
+                    errorcode = "cannot_connect"
 
-            _LOGGER.warning(
-                "OpenMediaVault %s connection error: %s", self._host, errorcode
-            )
+                _LOGGER.warning(
+                    "OpenMediaVault %s connection error: %s", self._host, errorcode
+                )
 
-            error_code = errorcode
-            self.error = error_code
-            self._connected = False
-            self.disconnect("connect")
-            self.lock.release()
+                error_code = errorcode
+                self.error = error_code
+                self._connected = False
+                self.disconnect("connect")
 
-        return self._connected
+            return self._connected
 
     # ---------------------------
     #   error_to_strings
@@ -237,7 +326,16 @@ class OpenMediaVaultAPI(object):
     # ---------------------------
     #   query
     # ---------------------------
-    def query(self, service, method, params=None, options=None) -> Optional(list):
+    def query(
+        self,
+        service,
+        method,
+        params=None,
+        options=None,
+        ttl=None,
+        keep_hash=False,
+        _retried=False,
+    ) -> Optional(list):
         """Retrieve data from OMV."""
         if not self.connection_check():
             return None
@@ -248,8 +346,22 @@ class OpenMediaVaultAPI(object):
         if not options:
             options = {"updatelastaccess": True}
 
-        self.lock.acquire()
+        if ttl is None:
+            ttl = QUERY_TTL.get((service, method), 0)
+
+        cache_key = query_cache_key(service, method, params)
+        cached = self._cache.get(cache_key)
+        if cached and cached[0] > time():
+            return cached[1]
+
+        # Failed queries must not leave a stale entry behind
+        self._cache.pop(cache_key, None)
+
+        # Login is serialized by self.lock, queries can run in parallel
+        connection = self._connection
+        data = None
         error = False
+        session_expired = False
         try:
             _LOGGER.debug(
                 "OpenMediaVault %s query: %s, %s, %s, %s",
@@ -259,7 +371,7 @@ class OpenMediaVaultAPI(object):
                 params,
                 options,
             )
-            response = self._connection.post(
+            response = connection.post(
                 self._resource,
                 data=json.dumps(
                     {
@@ -273,8 +385,10 @@ class OpenMediaVaultAPI(object):
             )
 
             if response.status_code == 200:
-                data = response.json()
+                data = json_loads(response.content)
                 _LOGGER.debug("OpenMediaVault %s query response: %s", self._host, data)
+            elif response.status_code == 401:
+                session_expired = True
             else:
                 error = True
 
@@ -284,11 +398,9 @@ class OpenMediaVaultAPI(object):
         ) as api_error:
             _LOGGER.warning("OpenMediaVault %s unable to fetch data", self._host)
             self.disconnect("query", api_error)
-            self.lock.release()
             return None
         except:
             self.disconnect("query")
-            self.lock.release()
             return None
 
         # Socket errors
@@ -305,7 +417,6 @@ class OpenMediaVaultAPI(object):
             error_code = errorcode
             self.error = error_code
             self._connected = False
-            self.lock.release()
             return None
 
         # Api errors
@@ -318,12 +429,46 @@ class OpenMediaVaultAPI(object):
                 or error_message == "Session not authenticated."
                 or error_message == "Session expired."
             ):
-                _LOGGER.debug("OpenMediaVault %s session expired", self._host)
-                self.error = 5001
-                if self.connect():
-                    return self.query(service, method, params, options)
+                session_expired = True
+
+        if session_expired:
+            _LOGGER.debug("OpenMediaVault %s session expired", self._host)
+            self.error = 5001
+            # Login accepted but session still rejected, do not loop
+            if _retried:
+                _LOGGER.warning(
+                    "OpenMediaVault %s session rejected after login", self._host
+                )
+                self._connected = False
+                return None
+
+            if self.connect(connection):
+                return self.query(
+                    service, method, params, options, ttl, keep_hash, _retried=True
+                )
+
+            return None
 
         self.error = None
-        self.lock.release()
+        # Only keep responses reused from cache or compared by query_hash
+        if data["error"] is None and (ttl > 0 or keep_hash):
+            # Hash is computed on demand by query_hash
+            self._cache[cache_key] = [time() + ttl, data["response"], None]
 
         return data["response"]
+
+    # ---------------------------
+    #   query_hash
+    # ---------------------------
+    def query_hash(self, service, method, params=None) -> Optional(str):
+        """Return hash of the last successful query response."""
+        cached = self._cache.get(query_cache_key(service, method, params))
+        if not cached:
+            return None
+
+        if cached[2] is None:
+            cached[2] = blake2b(
+                json.dumps(cached[1], sort_keys=True).encode(), digest_size=8
+            ).hexdigest()
+
+        return cached[2]
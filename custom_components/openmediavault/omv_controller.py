@@ -1,8 +1,11 @@
 """OpenMediaVault Controller."""
 
 import asyncio
-import pytz
-from datetime import datetime, timedelta
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from time import monotonic, time
 
 from homeassistant.const import (
     CONF_HOST,
@@ -15,27 +18,136 @@ from homeassistant.const import (
 from homeassistant.core import callback
 from homeassistant.helpers.dispatcher import async_dispatcher_send
 from homeassistant.helpers.event import async_track_time_interval
+from homeassistant.util import dt as dt_util
 
 from .const import DOMAIN
-from .apiparser import parse_api
+from .apiparser import from_entry, parse_api
 from .omv_api import OpenMediaVaultAPI
 
-DEFAULT_TIME_ZONE = None
+_LOGGER = logging.getLogger(__name__)
+
+SMART_SKIP_PREFIX = ("mmcblk", "sr", "bcache")
+
+SMART_ATTRS = frozenset(
+    (
+        "Raw_Read_Error_Rate",
+        "Spin_Up_Time",
+        "Start_Stop_Count",
+        "Reallocated_Sector_Ct",
+        "Seek_Error_Rate",
+        "Load_Cycle_Count",
+        "Temperature_Celsius",
+        "UDMA_CRC_Error_Count",
+        "Multi_Zone_Error_Rate",
+    )
+)
+
+# ---------------------------
+#   parse_api tables
+# ---------------------------
+HWINFO_VALS = (
+    {"name": "hostname", "default": "unknown"},
+    {"name": "version", "default": "unknown"},
+    {"name": "cpuUsage", "default": 0},
+    {"name": "memTotal", "default": 0},
+    {"name": "memUsed", "default": 0},
+    {"name": "uptime", "default": "0 days 0 hours 0 minutes 0 seconds"},
+    {"name": "configDirty", "type": "bool", "default": False},
+    {"name": "rebootRequired", "type": "bool", "default": False},
+    {"name": "pkgUpdatesAvailable", "type": "bool", "default": False},
+)
+
+HWINFO_ENSURE_VALS = ({"name": "memUsage", "default": 0},)
+
+DISK_VALS = (
+    {"name": "devicename"},
+    {"name": "canonicaldevicefile"},
+    {"name": "size", "default": "unknown"},
+    {"name": "israid", "type": "bool", "default": False},
+    {"name": "isroot", "type": "bool", "default": False},
+)
+
+DISK_ENSURE_VALS = (
+    {"name": "devicemodel", "default": "unknown"},
+    {"name": "serialnumber", "default": "unknown"},
+    {"name": "firmwareversion", "default": "unknown"},
+    {"name": "sectorsize", "default": "unknown"},
+    {"name": "rotationrate", "default": "unknown"},
+    {"name": "writecacheis", "default": "unknown"},
+    {"name": "smartsupportis", "default": "unknown"},
+    {"name": "Raw_Read_Error_Rate", "default": "unknown"},
+    {"name": "Spin_Up_Time", "default": "unknown"},
+    {"name": "Start_Stop_Count", "default": "unknown"},
+    {"name": "Reallocated_Sector_Ct", "default": "unknown"},
+    {"name": "Seek_Error_Rate", "default": "unknown"},
+    {"name": "Load_Cycle_Count", "default": "unknown"},
+    {"name": "Temperature_Celsius", "default": "unknown"},
+    {"name": "UDMA_CRC_Error_Count", "default": "unknown"},
+    {"name": "Multi_Zone_Error_Rate", "default": "unknown"},
+)
+
+SMART_INFO_VALS = (
+    {"name": "devicemodel", "default": "unknown"},
+    {"name": "serialnumber", "default": "unknown"},
+    {"name": "firmwareversion", "default": "unknown"},
+    {"name": "sectorsize", "default": "unknown"},
+    {"name": "rotationrate", "default": "unknown"},
+    {"name": "writecacheis", "type": "bool", "default": False},
+    {"name": "smartsupportis", "type": "bool", "default": False},
+)
+
+SMART_INFO_FIELDS = tuple(val["name"] for val in SMART_INFO_VALS)
+
+FS_VALS = (
+    {"name": "uuid"},
+    {"name": "parentdevicefile", "default": "unknown"},
+    {"name": "label", "default": "unknown"},
+    {"name": "type", "default": "unknown"},
+    {"name": "mountpoint", "default": "unknown"},
+    {"name": "available", "default": "unknown"},
+    {"name": "size", "default": "unknown"},
+    {"name": "percentage", "default": "unknown"},
+    {"name": "_readonly", "type": "bool", "default": False},
+    {"name": "_used", "type": "bool", "default": False},
+)
+
+FS_SKIP = (
+    {"name": "type", "value": "swap"},
+    {"name": "type", "value": "iso9660"},
+)
+
+SERVICE_VALS = (
+    {"name": "name"},
+    {"name": "title", "default": "unknown"},
+    {"name": "enabled", "type": "bool", "default": False},
+    {"name": "running", "type": "bool", "default": False},
+)
+
+PLUGIN_VALS = (
+    {"name": "name"},
+    {"name": "installed", "type": "bool", "default": False},
+)
 
 
 def utc_from_timestamp(timestamp: float) -> datetime:
     """Return a UTC time from a timestamp."""
-    return pytz.utc.localize(datetime.utcfromtimestamp(timestamp))
+    return datetime.fromtimestamp(timestamp, timezone.utc)
 
 
 def as_local(dattim: datetime) -> datetime:
     """Convert a UTC datetime object to local time zone."""
-    if dattim.tzinfo == DEFAULT_TIME_ZONE:
+    if dattim.tzinfo is dt_util.DEFAULT_TIME_ZONE:
         return dattim
     if dattim.tzinfo is None:
-        dattim = pytz.utc.localize(dattim)
+        dattim = dattim.replace(tzinfo=timezone.utc)
+
+    return dattim.astimezone(dt_util.DEFAULT_TIME_ZONE)
 
-    return dattim.astimezone(DEFAULT_TIME_ZONE)
+
+@lru_cache(maxsize=512)
+def to_gib(size) -> float:
+    """Convert a size in bytes to GiB."""
+    return round(int(size) / (1 << 30), 1)
 
 
 # ---------------------------
@@ -61,6 +173,15 @@ class OMVControllerData(object):
 
         self.listeners = []
         self.lock = asyncio.Lock()
+        self._update_done = asyncio.Event()
+        self._connected = False
+        self._last_hash = {}
+        self._boot_epoch_cached = 0
+        self._boot_epoch_iso = ""
+        self._boot_epoch_tz = None
+        self._smart_targets = []
+        self._version_major_gt5 = None
+        self._last_hwinfo_ts = 0.0
 
         self.api = OpenMediaVaultAPI(
             hass,
@@ -111,6 +232,18 @@ class OMVControllerData(object):
         """Return connected state."""
         return self.api.connected()
 
+    # ---------------------------
+    #   source_unchanged
+    # ---------------------------
+    def source_unchanged(self, section, service, method) -> bool:
+        """Return True if API response for section did not change since last parse."""
+        digest = self.api.query_hash(service, method)
+        if digest is not None and self._last_hash.get(section) == digest:
+            return True
+
+        self._last_hash[section] = digest
+        return False
+
     # ---------------------------
     #   force_hwinfo_update
     # ---------------------------
@@ -126,16 +259,19 @@ class OMVControllerData(object):
         """Update OpenMediaVault hardware info."""
         try:
             await asyncio.wait_for(self.lock.acquire(), timeout=30)
-        except Exception:
+        except asyncio.TimeoutError:
+            _LOGGER.debug("OpenMediaVault %s hwinfo update timed out", self.host)
             return
 
-        await self.hass.async_add_executor_job(self.get_hwinfo)
-        if self.api.connected():
-            await self.hass.async_add_executor_job(self.get_plugin)
-        if self.api.connected():
-            await self.hass.async_add_executor_job(self.get_disk)
-
-        self.lock.release()
+        try:
+            await self.hass.async_add_executor_job(self.get_hwinfo)
+            if self._connected:
+                await asyncio.gather(
+                    self.hass.async_add_executor_job(self.get_plugin),
+                    self.hass.async_add_executor_job(self.get_disk),
+                )
+        finally:
+            self.lock.release()
 
     # ---------------------------
     #   force_update
@@ -150,81 +286,91 @@ class OMVControllerData(object):
     # ---------------------------
     async def async_update(self):
         """Update OMV data."""
+        if self.lock.locked():
+            _LOGGER.debug("OpenMediaVault %s update already in progress", self.host)
+            return
+
         if self.api.has_reconnected():
+            # OMV may have been upgraded while we were disconnected
+            self._version_major_gt5 = None
             await self.async_hwinfo_update()
 
-        try:
-            await asyncio.wait_for(self.lock.acquire(), timeout=10)
-        except Exception:
-            return
+        async with self.lock:
+            await self.hass.async_add_executor_job(self.get_hwinfo)
+            if self._connected:
+                await asyncio.gather(
+                    self.hass.async_add_executor_job(self.get_fs),
+                    self.hass.async_add_executor_job(self.get_smart),
+                    self.hass.async_add_executor_job(self.get_service),
+                )
+                self._update_done.set()
+                self._update_done.clear()
 
-        await self.hass.async_add_executor_job(self.get_hwinfo)
-        if self.api.connected():
-            await self.hass.async_add_executor_job(self.get_fs)
-        if self.api.connected():
-            await self.hass.async_add_executor_job(self.get_smart)
-        if self.api.connected():
-            await self.hass.async_add_executor_job(self.get_service)
+            async_dispatcher_send(self.hass, self.signal_update)
 
-        async_dispatcher_send(self.hass, self.signal_update)
-        self.lock.release()
+    # ---------------------------
+    #   wait_for_update
+    # ---------------------------
+    async def wait_for_update(self, timeout=30):
+        """Wait until the next OMV data update has completed."""
+        await asyncio.wait_for(self._update_done.wait(), timeout)
 
     # ---------------------------
     #   get_hwinfo
     # ---------------------------
     def get_hwinfo(self):
         """Get hardware info from OMV."""
+        # Skip when just fetched by the other update path
+        now = monotonic()
+        if now - self._last_hwinfo_ts < 5:
+            return
+
+        self._last_hwinfo_ts = now
+        tmp = self.api.query("System", "getInformation")
+        self._connected = self.api.connected()
         self.data["hwinfo"] = parse_api(
             data=self.data["hwinfo"],
-            source=self.api.query("System", "getInformation"),
-            vals=[
-                {"name": "hostname", "default": "unknown"},
-                {"name": "version", "default": "unknown"},
-                {"name": "cpuUsage", "default": 0},
-                {"name": "memTotal", "default": 0},
-                {"name": "memUsed", "default": 0},
-                {"name": "uptime", "default": "0 days 0 hours 0 minutes 0 seconds"},
-                {"name": "configDirty", "type": "bool", "default": False},
-                {"name": "rebootRequired", "type": "bool", "default": False},
-                {"name": "pkgUpdatesAvailable", "type": "bool", "default": False},
-            ],
-            ensure_vals=[{"name": "memUsage", "default": 0}],
+            source=tmp,
+            vals=HWINFO_VALS,
+            ensure_vals=HWINFO_ENSURE_VALS,
         )
 
-        if not self.api.connected():
+        if not self._connected:
             return
 
-        tmp_uptime = 0
-        if int(self.data["hwinfo"]["version"].split(".")[0]) > 5:
-            tmp = self.data["hwinfo"]["uptime"]
-            pos = abs(int(tmp))
-            day = pos / (3600 * 24)
-            rem = pos % (3600 * 24)
-            hour = rem / 3600
-            rem = rem % 3600
-            mins = rem / 60
-            secs = rem % 60
-            res = "%d days %02d hours %02d minutes %02d seconds" % (
-                day,
-                hour,
-                mins,
-                secs,
-            )
-            if int(tmp) < 0:
-                res = "-%s" % res
-            tmp = res.split(" ")
+        if self._version_major_gt5 is None:
+            try:
+                self._version_major_gt5 = (
+                    int(self.data["hwinfo"]["version"].split(".", 1)[0]) > 5
+                )
+            except ValueError:
+                self._version_major_gt5 = False
+
+        if self._version_major_gt5:
+            tmp_uptime = int(self.data["hwinfo"]["uptime"])
         else:
             tmp = self.data["hwinfo"]["uptime"].split(" ")
+            tmp_uptime = (
+                int(tmp[0]) * 86400  # days
+                + int(tmp[2]) * 3600  # hours
+                + int(tmp[4]) * 60  # minutes
+                + int(tmp[6])  # seconds
+            )
 
-        tmp_uptime += int(tmp[0]) * 86400  # days
-        tmp_uptime += int(tmp[2]) * 3600  # hours
-        tmp_uptime += int(tmp[4]) * 60  # minutes
-        tmp_uptime += int(tmp[6])  # seconds
-        now = datetime.now().replace(microsecond=0)
-        uptime_tm = datetime.timestamp(now - timedelta(seconds=tmp_uptime))
-        self.data["hwinfo"]["uptimeEpoch"] = str(
-            as_local(utc_from_timestamp(uptime_tm)).isoformat()
-        )
+        boot_epoch = int(time()) - tmp_uptime
+        # Boot time only moves with clock skew, reformat when it drifts
+        # or the time zone changes
+        if (
+            abs(boot_epoch - self._boot_epoch_cached) > 2
+            or self._boot_epoch_tz is not dt_util.DEFAULT_TIME_ZONE
+        ):
+            self._boot_epoch_cached = boot_epoch
+            self._boot_epoch_tz = dt_util.DEFAULT_TIME_ZONE
+            self._boot_epoch_iso = str(
+                as_local(utc_from_timestamp(boot_epoch)).isoformat()
+            )
+
+        self.data["hwinfo"]["uptimeEpoch"] = self._boot_epoch_iso
 
         self.data["hwinfo"]["cpuUsage"] = round(self.data["hwinfo"]["cpuUsage"], 1)
         mem = (
@@ -240,175 +386,126 @@ class OMVControllerData(object):
     # ---------------------------
     def get_disk(self):
         """Get all filesystems from OMV."""
+        tmp = self.api.query("DiskMgmt", "enumerateDevices", keep_hash=True)
+        if self.source_unchanged("disk", "DiskMgmt", "enumerateDevices"):
+            return
+
         self.data["disk"] = parse_api(
             data=self.data["disk"],
-            source=self.api.query("DiskMgmt", "enumerateDevices"),
+            source=tmp,
             key="devicename",
-            vals=[
-                {"name": "devicename"},
-                {"name": "canonicaldevicefile"},
-                {"name": "size", "default": "unknown"},
-                {"name": "israid", "type": "bool", "default": False},
-                {"name": "isroot", "type": "bool", "default": False},
-            ],
-            ensure_vals=[
-                {"name": "devicemodel", "default": "unknown"},
-                {"name": "serialnumber", "default": "unknown"},
-                {"name": "firmwareversion", "default": "unknown"},
-                {"name": "sectorsize", "default": "unknown"},
-                {"name": "rotationrate", "default": "unknown"},
-                {"name": "writecacheis", "default": "unknown"},
-                {"name": "smartsupportis", "default": "unknown"},
-                {"name": "Raw_Read_Error_Rate", "default": "unknown"},
-                {"name": "Spin_Up_Time", "default": "unknown"},
-                {"name": "Start_Stop_Count", "default": "unknown"},
-                {"name": "Reallocated_Sector_Ct", "default": "unknown"},
-                {"name": "Seek_Error_Rate", "default": "unknown"},
-                {"name": "Load_Cycle_Count", "default": "unknown"},
-                {"name": "Temperature_Celsius", "default": "unknown"},
-                {"name": "UDMA_CRC_Error_Count", "default": "unknown"},
-                {"name": "Multi_Zone_Error_Rate", "default": "unknown"},
-            ],
+            vals=DISK_VALS,
+            ensure_vals=DISK_ENSURE_VALS,
         )
 
+        self._smart_targets = [
+            uid
+            for uid, disk in self.data["disk"].items()
+            if not disk["devicename"].startswith(SMART_SKIP_PREFIX)
+        ]
+
     # ---------------------------
     #   get_smart
     # ---------------------------
     def get_smart(self):
-        for uid in self.data["disk"]:
-            if self.data["disk"][uid]["devicename"].startswith("mmcblk"):
-                continue
-
-            if self.data["disk"][uid]["devicename"].startswith("sr"):
-                continue
-
-            if self.data["disk"][uid]["devicename"].startswith("bcache"):
-                continue
+        """Get S.M.A.R.T. information from OMV."""
+        targets = self._smart_targets
+        if not targets:
+            return
 
-            tmp_data = parse_api(
-                data={},
-                source=self.api.query(
+        with ThreadPoolExecutor(max_workers=min(8, len(targets))) as executor:
+            info_futures = {
+                uid: executor.submit(
+                    self.api.query,
                     "Smart",
                     "getInformation",
                     {"devicefile": self.data["disk"][uid]["canonicaldevicefile"]},
-                ),
-                vals=[
-                    {"name": "devicemodel", "default": "unknown"},
-                    {"name": "serialnumber", "default": "unknown"},
-                    {"name": "firmwareversion", "default": "unknown"},
-                    {"name": "sectorsize", "default": "unknown"},
-                    {"name": "rotationrate", "default": "unknown"},
-                    {"name": "writecacheis", "type": "bool", "default": False},
-                    {"name": "smartsupportis", "type": "bool", "default": False},
-                ],
+                )
+                for uid in targets
+            }
+            attr_futures = {
+                uid: executor.submit(
+                    self.api.query,
+                    "Smart",
+                    "getAttributes",
+                    {"devicefile": self.data["disk"][uid]["canonicaldevicefile"]},
+                )
+                for uid in targets
+            }
+
+        for uid in targets:
+            disk_uid = self.data["disk"][uid]
+            tmp_data = parse_api(
+                data={},
+                source=info_futures[uid].result(),
+                vals=SMART_INFO_VALS,
             )
 
             if not tmp_data:
                 continue
 
-            self.data["disk"][uid]["devicemodel"] = tmp_data["devicemodel"]
-            self.data["disk"][uid]["serialnumber"] = tmp_data["serialnumber"]
-            self.data["disk"][uid]["firmwareversion"] = tmp_data["firmwareversion"]
-            self.data["disk"][uid]["sectorsize"] = tmp_data["sectorsize"]
-            self.data["disk"][uid]["rotationrate"] = tmp_data["rotationrate"]
-            self.data["disk"][uid]["writecacheis"] = tmp_data["writecacheis"]
-            self.data["disk"][uid]["smartsupportis"] = tmp_data["smartsupportis"]
+            disk_uid.update((key, tmp_data[key]) for key in SMART_INFO_FIELDS)
 
-            tmp_data = parse_api(
-                data={},
-                source=self.api.query(
-                    "Smart",
-                    "getAttributes",
-                    {"devicefile": self.data["disk"][uid]["canonicaldevicefile"]},
-                ),
-                key="attrname",
-                vals=[
-                    {"name": "attrname"},
-                    {"name": "threshold", "default": 0},
-                    {"name": "rawvalue", "default": 0},
-                ],
-            )
-            if not tmp_data:
+            # Pick the tracked attributes straight from the response
+            source = attr_futures[uid].result()
+            if not isinstance(source, list):
                 continue
 
-            vals = [
-                "Raw_Read_Error_Rate",
-                "Spin_Up_Time",
-                "Start_Stop_Count",
-                "Reallocated_Sector_Ct",
-                "Seek_Error_Rate",
-                "Load_Cycle_Count",
-                "Temperature_Celsius",
-                "UDMA_CRC_Error_Count",
-                "Multi_Zone_Error_Rate",
-            ]
-
-            for tmp_val in vals:
-                if tmp_val in tmp_data:
-                    if (
-                        isinstance(tmp_data[tmp_val]["rawvalue"], str)
-                        and " " in tmp_data[tmp_val]["rawvalue"]
-                    ):
-                        tmp_data[tmp_val]["rawvalue"] = tmp_data[tmp_val][
-                            "rawvalue"
-                        ].split(" ")[0]
-
-                    self.data["disk"][uid][tmp_val] = tmp_data[tmp_val]["rawvalue"]
+            for entry in source:
+                tmp_val = entry.get("attrname")
+                if tmp_val not in SMART_ATTRS:
+                    continue
+
+                raw = from_entry(entry, "rawvalue", default=0)
+                if isinstance(raw, str) and " " in raw:
+                    raw = raw.split(" ", 1)[0]
+
+                disk_uid[tmp_val] = raw
 
     # ---------------------------
     #   get_fs
     # ---------------------------
     def get_fs(self):
         """Get all filesystems from OMV."""
+        tmp = self.api.query(
+            "FileSystemMgmt", "enumerateFilesystems", keep_hash=True
+        )
+        if self.source_unchanged("fs", "FileSystemMgmt", "enumerateFilesystems"):
+            return
+
         self.data["fs"] = parse_api(
             data=self.data["fs"],
-            source=self.api.query("FileSystemMgmt", "enumerateFilesystems"),
+            source=tmp,
             key="uuid",
-            vals=[
-                {"name": "uuid"},
-                {"name": "parentdevicefile", "default": "unknown"},
-                {"name": "label", "default": "unknown"},
-                {"name": "type", "default": "unknown"},
-                {"name": "mountpoint", "default": "unknown"},
-                {"name": "available", "default": "unknown"},
-                {"name": "size", "default": "unknown"},
-                {"name": "percentage", "default": "unknown"},
-                {"name": "_readonly", "type": "bool", "default": False},
-                {"name": "_used", "type": "bool", "default": False},
-            ],
-            skip=[
-                {"name": "type", "value": "swap"},
-                {"name": "type", "value": "iso9660"},
-            ],
+            vals=FS_VALS,
+            skip=FS_SKIP,
         )
 
         for uid in self.data["fs"]:
-            self.data["fs"][uid]["size"] = round(
-                int(self.data["fs"][uid]["size"]) / 1073741824, 1
-            )
-            self.data["fs"][uid]["available"] = round(
-                int(self.data["fs"][uid]["available"]) / 1073741824, 1
-            )
+            for tmp_val in ("size", "available"):
+                # Entries missing from the response are already converted
+                if not isinstance(self.data["fs"][uid][tmp_val], float):
+                    self.data["fs"][uid][tmp_val] = to_gib(
+                        self.data["fs"][uid][tmp_val]
+                    )
 
     # ---------------------------
     #   get_service
     # ---------------------------
     def get_service(self):
         """Get OMV services status"""
-        tmp = self.api.query("Services", "getStatus")
-        if "data" in tmp:
+        tmp = self.api.query("Services", "getStatus", keep_hash=True)
+        if self.source_unchanged("service", "Services", "getStatus"):
+            return
+
+        if tmp and "data" in tmp:
             tmp = tmp["data"]
 
         self.data["service"] = parse_api(
             data=self.data["service"],
             source=tmp,
             key="name",
-            vals=[
-                {"name": "name"},
-                {"name": "title", "default": "unknown"},
-                {"name": "enabled", "type": "bool", "default": False},
-                {"name": "running", "type": "bool", "default": False},
-            ],
+            vals=SERVICE_VALS,
         )
 
     # ---------------------------
@@ -416,12 +513,13 @@ class OMVControllerData(object):
     # ---------------------------
     def get_plugin(self):
         """Get OMV plugin status"""
+        tmp = self.api.query("Plugin", "enumeratePlugins", keep_hash=True)
+        if self.source_unchanged("plugin", "Plugin", "enumeratePlugins"):
+            return
+
         self.data["plugin"] = parse_api(
             data=self.data["plugin"],
-            source=self.api.query("Plugin", "enumeratePlugins"),
+            source=tmp,
             key="name",
-            vals=[
-                {"name": "name"},
-                {"name": "installed", "type": "bool", "default": False},
-            ],
+            vals=PLUGIN_VALS,
         )